@@ -17,7 +17,8 @@ async def stream_data_command(args):
     fetcher = TimeSeriesDataFetcher(
         chunk_size=args.chunk_size,
         time_interval_minutes=args.time_interval,
-        max_connections=args.max_connections
+        max_connections=args.max_connections,
+        adaptive_windows=args.adaptive_windows
     )
     
     try:
@@ -49,7 +50,7 @@ async def stream_data_command(args):
         
         async for chunk in data_stream:
             total_chunks += 1
-            chunk_size = chunk["chunk_size"]
+            chunk_size = chunk.chunk_size
             total_records += chunk_size
             
             if args.output:
@@ -81,7 +82,8 @@ async def export_data_command(args):
     fetcher = TimeSeriesDataFetcher(
         chunk_size=args.chunk_size,
         time_interval_minutes=args.time_interval,
-        max_connections=args.max_connections
+        max_connections=args.max_connections,
+        adaptive_windows=args.adaptive_windows
     )
     
     try:
@@ -100,7 +102,8 @@ async def export_data_command(args):
             output_format=args.format,
             use_time_windows=args.use_time_windows,
             where_conditions=args.where,
-            select_fields=args.fields
+            select_fields=args.fields,
+            bulk=args.bulk or None
         )
         
         print("数据导出完成!")
@@ -142,6 +145,7 @@ def list_tables_command(args):
         print(f"  时间字段: {config['time_field']}")
         print(f"  主键: {config['primary_key']}")
         print(f"  排序字段: {', '.join(config['order_fields'])}")
+        print(f"  默认字段: {', '.join(config.get('default_projection') or ['*'])}")
         print()
 
 def create_parser():
@@ -178,8 +182,9 @@ def create_parser():
     stream_parser.add_argument("--max-connections", type=int, default=3, help="最大数据库连接数")
     stream_parser.add_argument("--use-time-windows", action="store_true", default=True, help="使用时间窗口分块")
     stream_parser.add_argument("--no-time-windows", dest="use_time_windows", action="store_false", help="不使用时间窗口分块")
+    stream_parser.add_argument("--adaptive-windows", action="store_true", help="根据数据密度自适应调整时间窗口大小")
     stream_parser.add_argument("--where", help="额外的WHERE条件")
-    stream_parser.add_argument("--fields", nargs="+", help="要选择的字段列表")
+    stream_parser.add_argument("--fields", nargs="+", help="要选择的字段列表（'*' 表示全部字段）")
     stream_parser.add_argument("--output", help="输出文件路径(不指定则输出到控制台)")
     stream_parser.add_argument("--verbose", "-v", action="store_true", help="详细输出")
     
@@ -195,8 +200,10 @@ def create_parser():
     export_parser.add_argument("--max-connections", type=int, default=3, help="最大数据库连接数")
     export_parser.add_argument("--use-time-windows", action="store_true", default=True, help="使用时间窗口分块")
     export_parser.add_argument("--no-time-windows", dest="use_time_windows", action="store_false", help="不使用时间窗口分块")
+    export_parser.add_argument("--adaptive-windows", action="store_true", help="根据数据密度自适应调整时间窗口大小")
+    export_parser.add_argument("--bulk", action="store_true", help="使用COPY批量导出(仅csv/parquet，--no-time-windows时自动启用)")
     export_parser.add_argument("--where", help="额外的WHERE条件")
-    export_parser.add_argument("--fields", nargs="+", help="要选择的字段列表")
+    export_parser.add_argument("--fields", nargs="+", help="要选择的字段列表（'*' 表示全部字段）")
     
     # 统计数据命令
     count_parser = subparsers.add_parser("count", help="统计数据数量")
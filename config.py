@@ -15,11 +15,13 @@ DATABASE_CONFIG = {
 }
 
 # 表配置：定义每个表的时间字段和主要字段
+# default_projection: 未指定select_fields时默认选择的字段，未配置时选择全部字段
 TABLE_CONFIGS = {
     "tweets": {
         "time_field": "created_at_ts",
         "primary_key": "tweet_id",
         "order_fields": ["created_at_ts", "tweet_id"],
+        "default_projection": ["tweet_id", "user_id", "text", "created_at_ts", "likes", "retweets"],
         "description": "推文数据表"
     },
     "replies": {
@@ -32,6 +34,10 @@ TABLE_CONFIGS = {
         "time_field": "updated_at",
         "primary_key": "user_id",
         "order_fields": ["updated_at", "user_id"],
+        "default_projection": [
+            "user_id", "user_name", "user_screen_name", "user_verified",
+            "user_followers_count", "user_following_count", "user_tweets_count", "updated_at"
+        ],
         "description": "用户数据表"
     },
     "followers": {
@@ -74,11 +80,22 @@ DEFAULT_CONFIG = {
     "include_metadata": True,  # 是否包含元数据
     "max_connections": 3,  # 最大数据库连接数
     "fetch_timeout": 300,  # 查询超时时间（秒）
+    "statement_cache_size": 1024,  # 每个连接缓存的预处理语句数量
+    "max_inactive_connection_lifetime": 300,  # 空闲连接的最长保留时间（秒）
+    "adaptive_windows": False,  # 是否根据数据密度自适应调整时间窗口大小
+    "adaptive_target_chunks": 5,  # 自适应窗口的目标大小（每个窗口约包含多少个数据块）
+    "min_interval_minutes": 1,  # 自适应窗口的最小间隔（分钟）
+    "max_interval_minutes": 1440,  # 自适应窗口的最大间隔（分钟）
+    "pace_seconds": 0.0,  # 每获取一个数据块后的等待时间（秒），0表示不限速
+    "write_buffer_bytes": 1 << 20,  # 导出文件时的写缓冲区大小（字节）
 }
 
 # 支持的输出格式
 SUPPORTED_FORMATS = ["json", "csv", "parquet", "jsonl"]
 
+# 参数化筛选条件支持的比较运算符
+WHERE_OPERATORS = ["=", "!=", "<", "<=", ">", ">="]
+
 # 支持的时间格式
 TIME_FORMATS = [
     "%Y-%m-%d %H:%M:%S",
@@ -1,53 +1,546 @@
 import asyncio
 import asyncpg
-import json
-import csv
-import pandas as pd
+import math
+import orjson
+import os
+import re
+import tempfile
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Optional, AsyncGenerator, Any, Union
+from typing import Dict, List, Optional, AsyncGenerator, Any, Union, Iterable, Iterator, Sequence, Tuple
+from collections import deque
+from contextlib import aclosing, asynccontextmanager
+import dataclasses
+from collections.abc import Sequence as SequenceABC
+from functools import lru_cache
 from pathlib import Path
 import logging
-from io import StringIO
 
-from config import DATABASE_CONFIG, TABLE_CONFIGS, DEFAULT_CONFIG
+from config import DATABASE_CONFIG, TABLE_CONFIGS, DEFAULT_CONFIG, TIME_FORMATS, WHERE_OPERATORS
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 筛选条件：原始SQL字符串（需可信），{"字段 [运算符]": 值} 形式的参数化条件，
+# 或 (带 $1, $2... 占位符的条件模板, 参数值) 形式的元组
+WhereConditions = Union[str, Dict[str, Any], Tuple[str, Sequence[Any]]]
+
+_PLACEHOLDER_RE = re.compile(r"\$(\d+)")
+
+def _quote_ident(name: str) -> str:
+    """为SQL标识符加双引号"""
+    return '"' + name.replace('"', '""') + '"'
+
+def _parse_where_key(key: str) -> tuple:
+    """解析参数化筛选条件的键，如 "likes >" -> ("likes", ">")，省略运算符时为 "=" """
+    parts = key.split()
+    if len(parts) == 1:
+        return parts[0], "="
+    if len(parts) == 2 and parts[1] in WHERE_OPERATORS:
+        return parts[0], parts[1]
+    raise ValueError(f"无效的筛选条件: {key}")
+
+def _where_args(where_conditions: Optional[WhereConditions]) -> list:
+    """参数化筛选条件对应的参数值"""
+    if isinstance(where_conditions, dict):
+        return list(where_conditions.values())
+    if isinstance(where_conditions, tuple):
+        return list(where_conditions[1])
+    return []
+
+def _where_shape(where_conditions: Optional[WhereConditions]) -> Any:
+    """筛选条件的查询形状（参数化条件只取键），用作SQL缓存键"""
+    if isinstance(where_conditions, dict):
+        return tuple(where_conditions)
+    if isinstance(where_conditions, tuple):
+        return ("template", where_conditions[0])
+    return where_conditions
+
+def _renumber_placeholders(template: str, first_index: int) -> str:
+    """把条件模板中从 $1 开始的占位符整体平移为从 $first_index 开始"""
+    return _PLACEHOLDER_RE.sub(lambda m: f"${int(m.group(1)) + first_index - 1}", template)
+
+@lru_cache(maxsize=1024)
+def _parse_time_cached(time_str: str) -> datetime:
+    """解析时间字符串，结果按字符串缓存（datetime不可变，可安全共享）"""
+    for fmt in TIME_FORMATS:
+        try:
+            dt = datetime.strptime(time_str, fmt)
+            # 确保时区感知
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            return dt
+        except ValueError:
+            continue
+    
+    raise ValueError(f"无法解析时间格式: {time_str}")
+
+class _BatchRows(SequenceABC):
+    """
+    RecordBatch的行视图，兼容把 chunk["data"] 当作记录列表使用的代码
+    
+    按下标访问时只转换对应的行；遍历时才把整个批次转换为dict列表（结果缓存）。
+    """
+    
+    __slots__ = ("batch", "_rows")
+    
+    def __init__(self, batch: pa.RecordBatch):
+        self.batch = batch
+        self._rows = None
+    
+    def _materialize(self) -> List[Dict]:
+        if self._rows is None:
+            self._rows = self.batch.to_pylist()
+        return self._rows
+    
+    def __len__(self) -> int:
+        return self.batch.num_rows
+    
+    def __getitem__(self, index):
+        if self._rows is not None:
+            return self._rows[index]
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return self._materialize()[index]
+            return self.batch.slice(start, max(stop - start, 0)).to_pylist()
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("行下标超出范围")
+        return self.batch.slice(index, 1).to_pylist()[0]
+    
+    def __iter__(self):
+        return iter(self._materialize())
+
+@dataclasses.dataclass(slots=True)
+class Chunk:
+    """
+    流式获取产出的数据块
+    
+    按时间窗口获取时填充 window_* 和 total_records_so_far，按记录数分块时填充 chunk_index、
+    total_count 和 progress；未使用的字段为None。仍支持 chunk["data"]、chunk.get(...) 形式的访问，
+    值为None的字段视为不存在。
+    """
+    
+    window_index: Optional[int] = None
+    window_start: Optional[str] = None
+    window_end: Optional[str] = None
+    chunk_index: Optional[int] = None
+    chunk_offset: int = 0
+    chunk_size: int = 0
+    window_records: Optional[int] = None
+    total_records_so_far: Optional[int] = None
+    total_count: Optional[int] = None
+    progress: Optional[float] = None
+    data: Any = None
+    batch: Optional[pa.RecordBatch] = None
+    metadata: Optional[Dict] = None
+    
+    def __getitem__(self, key: str) -> Any:
+        value = getattr(self, key, None) if key in _CHUNK_FIELDS else None
+        if value is None:
+            raise KeyError(key)
+        return value
+    
+    def __contains__(self, key: str) -> bool:
+        return key in _CHUNK_FIELDS and getattr(self, key) is not None
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None) if key in _CHUNK_FIELDS else None
+        return default if value is None else value
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为dict，省略值为None的字段"""
+        return {
+            name: value for name in _CHUNK_FIELDS_ORDERED
+            if (value := getattr(self, name)) is not None
+        }
+
+_CHUNK_FIELDS_ORDERED = tuple(f.name for f in dataclasses.fields(Chunk))
+_CHUNK_FIELDS = frozenset(_CHUNK_FIELDS_ORDERED)
+
+def _json_default(obj: Any) -> Any:
+    """JSON序列化回调：asyncpg记录在序列化时才转换为dict，其余类型（如Decimal）转为字符串"""
+    if isinstance(obj, asyncpg.Record):
+        return dict(obj)
+    if isinstance(obj, Chunk):
+        # batch与data是同一批记录，只输出data
+        chunk = obj.to_dict()
+        chunk.pop("batch", None)
+        return chunk
+    if isinstance(obj, _BatchRows):
+        return obj.batch.to_pylist()
+    if isinstance(obj, pa.RecordBatch):
+        return obj.to_pylist()
+    return str(obj)
+
+def _json_dumps(data: Any, indent: bool = False) -> bytes:
+    """使用orjson序列化为UTF-8字节，datetime输出为ISO 8601格式"""
+    option = orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATACLASS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(data, default=_json_default, option=option)
+
+def _to_text(value: Any) -> str:
+    """按文本保存的列（numeric、uuid、枚举等）的值转换为字符串，dict/list转为JSON"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return orjson.dumps(value, default=_json_default).decode()
+    return str(value)
+
+def _column_array(values: list, dtype: pa.DataType) -> pa.Array:
+    """按指定类型构建一列；按文本保存的列在值不是字符串时先转换"""
+    try:
+        return pa.array(values, dtype)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        if pa.types.is_string(dtype):
+            return pa.array([None if v is None else _to_text(v) for v in values], dtype)
+        if pa.types.is_list(dtype) and pa.types.is_string(dtype.value_type):
+            return pa.array([None if v is None else [None if x is None else _to_text(x) for x in v]
+                             for v in values], dtype)
+        raise
+
+def _records_to_batch(records: List[asyncpg.Record], schema: Optional[pa.Schema] = None) -> pa.RecordBatch:
+    """
+    将asyncpg记录列表按列构建为Arrow RecordBatch
+    
+    给定schema（见 TimeSeriesDataFetcher._result_schema）时按其中的列类型构建，
+    同一查询的各数据块类型一致；否则类型由本块数据推断。
+    """
+    names = list(records[0].keys())
+    columns = map(list, zip(*records))
+    if schema is None:
+        return pa.RecordBatch.from_pydict(dict(zip(names, columns)))
+    return pa.RecordBatch.from_arrays(
+        [_column_array(values, field.type) for values, field in zip(columns, schema)], schema=schema
+    )
+
+def _check_return_format(return_format: str):
+    if return_format not in ("records", "arrow"):
+        raise ValueError(f"不支持的返回格式: {return_format}")
+
+def _cast_batch(batch: pa.RecordBatch, column_dtypes: Dict[str, Any]) -> pa.RecordBatch:
+    """按 column_dtypes 转换指定列的类型，其余列保持不变"""
+    arrays = []
+    fields = []
+    for field, array in zip(batch.schema, batch.columns):
+        dtype = column_dtypes.get(field.name)
+        if dtype is not None:
+            if not isinstance(dtype, pa.DataType):
+                dtype = pa.from_numpy_dtype(dtype)
+            array = array.cast(dtype)
+            field = field.with_type(dtype)
+        arrays.append(array)
+        fields.append(field)
+    return pa.RecordBatch.from_arrays(arrays, schema=pa.schema(fields))
+
+def _attach_batch(chunk: "Chunk",
+                  schema: Optional[pa.Schema] = None,
+                  column_dtypes: Optional[Dict[str, Any]] = None):
+    """把数据块的记录转换为列式的RecordBatch，data替换为其行视图"""
+    batch = _records_to_batch(chunk.data, schema)
+    if column_dtypes:
+        batch = _cast_batch(batch, column_dtypes)
+    chunk.batch = batch
+    chunk.data = _BatchRows(batch)
+
+def _records_to_arrow(records: List[asyncpg.Record], schema: Optional[pa.Schema] = None) -> pa.Table:
+    """将asyncpg记录列表按列构建为Arrow表，不经过中间的dict列表；schema的含义同 _records_to_batch"""
+    if isinstance(records, _BatchRows):
+        # 已是列式数据，直接使用（按 column_dtypes 转换过的列再转换回schema中的类型）
+        table = pa.Table.from_batches([records.batch])
+        if schema is not None and not table.schema.equals(schema):
+            table = table.cast(schema)
+        return table
+    return pa.Table.from_batches([_records_to_batch(records, schema)])
+
+def _nested_to_json(column: pa.ChunkedArray) -> pa.Array:
+    """把嵌套类型（数组、结构体）的列序列化为JSON字符串"""
+    return pa.array([None if v is None else orjson.dumps(v, default=_json_default).decode()
+                     for v in column.to_pylist()], pa.string())
+
+def _csv_compatible(table: pa.Table) -> pa.Table:
+    """CSV不支持嵌套类型（数组、结构体），将这类列序列化为JSON字符串"""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_nested(field.type):
+            table = table.set_column(i, pa.field(field.name, pa.string()), _nested_to_json(table.column(i)))
+    return table
+
+# PostgreSQL类型名 -> Arrow类型；未列出的类型（枚举、inet等）按文本处理
+_PG_ARROW_TYPES = {
+    "bool": pa.bool_(),
+    "int2": pa.int16(),
+    "int4": pa.int32(),
+    "int8": pa.int64(),
+    "float4": pa.float32(),
+    "float8": pa.float64(),
+    # 结果描述中没有numeric的精度和小数位数，按文本保存以免丢失精度
+    "numeric": pa.string(),
+    "text": pa.string(),
+    "varchar": pa.string(),
+    "bpchar": pa.string(),
+    "name": pa.string(),
+    "uuid": pa.string(),
+    "json": pa.string(),
+    "jsonb": pa.string(),
+    "bytea": pa.binary(),
+    "date": pa.date32(),
+    "time": pa.time64("us"),
+    "timestamp": pa.timestamp("us"),
+    "timestamptz": pa.timestamp("us", tz="UTC"),
+    "interval": pa.duration("us"),
+}
+
+def _arrow_type(pg_type: asyncpg.types.Type) -> pa.DataType:
+    """将asyncpg报告的列类型映射为Arrow类型，数组映射为列表"""
+    name = pg_type.name
+    if name.endswith("[]"):
+        return pa.list_(_PG_ARROW_TYPES.get(name[:-2], pa.string()))
+    if name.startswith("_"):
+        return pa.list_(_PG_ARROW_TYPES.get(name[1:], pa.string()))
+    return _PG_ARROW_TYPES.get(name, pa.string())
+
+def _attributes_schema(attributes: Sequence[asyncpg.types.Attribute]) -> pa.Schema:
+    """由预处理语句的结果列（PreparedStatement.get_attributes()）构建Arrow schema"""
+    return pa.schema([pa.field(a.name, _arrow_type(a.type)) for a in attributes])
+
+def _csv_column_types(schema: pa.Schema) -> Dict[str, pa.DataType]:
+    """读取COPY输出的CSV时各列的类型；CSV无法直接解析的类型（数组、二进制、时间间隔）按文本读取"""
+    parsable = (pa.types.is_boolean, pa.types.is_integer, pa.types.is_floating, pa.types.is_string,
+                pa.types.is_date, pa.types.is_time, pa.types.is_timestamp)
+    return {
+        field.name: field.type if any(check(field.type) for check in parsable) else pa.string()
+        for field in schema
+    }
+
+# 只在需要时加引号，与常见CSV输出保持一致
+_CSV_WRITE_OPTIONS = pacsv.WriteOptions(quoting_style="needed")
+
+class AdaptiveWindowPlanner:
+    """
+    自适应时间窗口规划器
+    
+    使每个窗口大约包含 target_rows 条记录：
+    - 提供了各时间桶的记录数（见 TimeSeriesDataFetcher.probe）时，直接据此规划窗口：
+      跳过空桶，合并相邻的稀疏桶，拆分过密的桶；
+    - 否则根据已处理窗口的数据密度（记录数/分钟）调整下一个窗口的宽度，
+      遇到空窗口时按倍数扩大窗口，快速跳过无数据区间。
+    """
+    
+    def __init__(self,
+                 start_dt: datetime,
+                 end_dt: datetime,
+                 initial_minutes: float,
+                 target_rows: int,
+                 min_minutes: float,
+                 max_minutes: float,
+                 growth_factor: float = 2.0,
+                 buckets: Optional[List[tuple]] = None,
+                 bucket_minutes: Optional[float] = None):
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.target_rows = target_rows
+        self.min_minutes = min_minutes
+        self.max_minutes = max_minutes
+        self.growth_factor = growth_factor
+        self.interval_minutes = self._clamp(initial_minutes)
+        # [(时间桶开始时间, 记录数), ...]，按时间排序，只包含非空桶
+        self.buckets = buckets
+        self.bucket_minutes = bucket_minutes or initial_minutes
+    
+    def _clamp(self, minutes: float) -> float:
+        return max(self.min_minutes, min(minutes, self.max_minutes))
+    
+    def __iter__(self) -> Iterator[tuple]:
+        """逐个产出时间窗口，每个窗口的宽度取决于时间桶分布或此前 observe() 的反馈"""
+        if self.buckets is not None:
+            yield from self._iter_bucket_windows()
+            return
+        
+        current_time = self.start_dt
+        
+        while current_time < self.end_dt:
+            window_end = min(
+                current_time + timedelta(minutes=self.interval_minutes),
+                self.end_dt
+            )
+            yield current_time, window_end
+            current_time = window_end
+    
+    def _iter_bucket_windows(self) -> Iterator[tuple]:
+        """根据时间桶的记录数规划窗口"""
+        bucket_width = timedelta(minutes=self.bucket_minutes)
+        window_start = None
+        window_rows = 0
+        prev_end = None
+        
+        for bucket_start, count in self.buckets:
+            bucket_end = min(bucket_start + bucket_width, self.end_dt)
+            
+            # 中间隔着空桶时先结束当前窗口，空桶不产生窗口
+            if window_start is not None and bucket_start != prev_end:
+                yield window_start, prev_end
+                window_start = None
+                window_rows = 0
+            
+            if count >= self.target_rows:
+                # 过密的桶单独拆分为若干等宽窗口，但不小于最小间隔
+                if window_start is not None:
+                    yield window_start, bucket_start
+                    window_start = None
+                    window_rows = 0
+                
+                parts = math.ceil(count / self.target_rows)
+                parts = min(parts, max(1, int(self.bucket_minutes // self.min_minutes)))
+                step = (bucket_end - bucket_start) / parts
+                for k in range(parts):
+                    part_end = bucket_start + step * (k + 1) if k < parts - 1 else bucket_end
+                    yield bucket_start + step * k, part_end
+            else:
+                # 稀疏的相邻桶合并，直到达到目标记录数
+                if window_start is None:
+                    window_start = bucket_start
+                window_rows += count
+                if window_rows >= self.target_rows:
+                    yield window_start, bucket_end
+                    window_start = None
+                    window_rows = 0
+            
+            prev_end = bucket_end
+        
+        if window_start is not None:
+            yield window_start, prev_end
+    
+    def observe(self, window_start: datetime, window_end: datetime, rows: int):
+        """记录一个窗口的实际记录数，并据此计算下一个窗口的宽度"""
+        minutes = (window_end - window_start).total_seconds() / 60
+        
+        if rows == 0:
+            next_minutes = self.interval_minutes * self.growth_factor
+        else:
+            density = rows / max(minutes, 1e-6)
+            next_minutes = self.target_rows / density
+        
+        self.interval_minutes = self._clamp(next_minutes)
+
+class PreparedFilter:
+    """
+    绑定了表、字段和参数化条件模板的查询，可以用不同的参数值反复执行
+    
+    由 TimeSeriesDataFetcher.prepared_filter() 创建。同一个过滤器生成的SQL文本不随参数值变化，
+    asyncpg会在每个连接上缓存其预处理语句，每个连接只需解析/规划一次。
+    """
+    
+    def __init__(self,
+                 fetcher: "TimeSeriesDataFetcher",
+                 table_name: str,
+                 select_fields: Optional[List[str]],
+                 predicate_template: str,
+                 param_count: int):
+        self.fetcher = fetcher
+        self.table_name = table_name
+        self.select_fields = select_fields
+        self.predicate_template = predicate_template
+        self.param_count = param_count
+    
+    def _bind(self, params: Sequence[Any]) -> tuple:
+        if len(params) != self.param_count:
+            raise ValueError(f"条件模板需要 {self.param_count} 个参数，实际传入 {len(params)} 个")
+        return (self.predicate_template, tuple(params))
+    
+    def stream(self,
+               params: Sequence[Any],
+               start_time: Union[str, datetime],
+               end_time: Union[str, datetime],
+               **options) -> AsyncGenerator[Chunk, None]:
+        """按时间窗口流式获取满足条件的数据，options 传给 stream_data_by_time_windows"""
+        return self.fetcher.stream_data_by_time_windows(
+            self.table_name, start_time, end_time, self._bind(params), self.select_fields,
+            **options
+        )
+    
+    async def count(self,
+                    params: Sequence[Any],
+                    start_time: Union[str, datetime],
+                    end_time: Union[str, datetime]) -> int:
+        """统计满足条件的记录数"""
+        return await self.fetcher.get_table_count(
+            self.table_name, start_time, end_time, self._bind(params)
+        )
+
 class TimeSeriesDataFetcher:
     """时间序列数据获取器，支持分块流式传输"""
     
     def __init__(self, 
                  chunk_size: int = None,
                  time_interval_minutes: int = None,
-                 max_connections: int = None):
+                 max_connections: int = None,
+                 adaptive_windows: bool = None,
+                 pace_seconds: float = None,
+                 include_metadata: bool = None,
+                 column_dtypes: Optional[Dict[str, Any]] = None):
         """
         初始化数据获取器
         
         Args:
             chunk_size: 每次查询的记录数
-            time_interval_minutes: 时间分块间隔（分钟）
+            time_interval_minutes: 时间分块间隔（分钟），启用自适应窗口时作为初始间隔
             max_connections: 最大数据库连接数
+            adaptive_windows: 是否根据数据密度自适应调整时间窗口大小
+            pace_seconds: 每获取一个数据块后的等待时间（秒），用于主动限速，默认不等待
+            include_metadata: 数据块中是否包含metadata（表名、时间字段、查询时间）
+            column_dtypes: 字段名 -> 目标类型（pyarrow类型或numpy dtype，如 np.int32），
+                           return_format="arrow" 时在返回前将这些列转换为更窄的类型，值超出范围时报错
         """
         self.chunk_size = chunk_size or DEFAULT_CONFIG["chunk_size"]
         self.time_interval_minutes = time_interval_minutes or DEFAULT_CONFIG["time_interval_minutes"]
         self.max_connections = max_connections or DEFAULT_CONFIG["max_connections"]
+        self.adaptive_windows = (DEFAULT_CONFIG["adaptive_windows"] 
+                                 if adaptive_windows is None else adaptive_windows)
+        self.pace_seconds = DEFAULT_CONFIG["pace_seconds"] if pace_seconds is None else pace_seconds
+        self.include_metadata = (DEFAULT_CONFIG["include_metadata"]
+                                 if include_metadata is None else include_metadata)
+        self.column_dtypes = column_dtypes or {}
         self.pool = None
+        # 所有查询共用的并发上限，超出时在这里排队，不会超额占用连接池
+        self._semaphore = asyncio.Semaphore(self.max_connections)
+        # 按查询形状缓存SQL文本
+        self._query_cache: Dict[tuple, str] = {}
+        # 各表的实际字段，用于校验字段名
+        self._columns_cache: Dict[str, frozenset] = {}
+        # 按SQL文本缓存查询结果的Arrow schema
+        self._schema_cache: Dict[str, pa.Schema] = {}
         
     async def init_connection(self):
         """初始化数据库连接池"""
         try:
+            # 预先建立一半的连接，避免首批查询承担建连开销
+            min_size = min(max(self.max_connections // 2, 2), self.max_connections)
             self.pool = await asyncpg.create_pool(
                 **DATABASE_CONFIG,
-                min_size=1,
-                max_size=self.max_connections
+                min_size=min_size,
+                max_size=self.max_connections,
+                statement_cache_size=DEFAULT_CONFIG["statement_cache_size"],
+                max_inactive_connection_lifetime=DEFAULT_CONFIG["max_inactive_connection_lifetime"],
+                command_timeout=DEFAULT_CONFIG["fetch_timeout"]
             )
             logger.info("数据库连接池初始化成功")
         except Exception as e:
             logger.error(f"数据库连接失败: {e}")
             raise
     
+    @asynccontextmanager
+    async def _acquire(self):
+        """在并发上限内从连接池获取连接"""
+        async with self._semaphore:
+            async with self.pool.acquire() as conn:
+                yield conn
+    
     async def close_connection(self):
         """关闭数据库连接"""
         if self.pool:
@@ -56,185 +549,737 @@ class TimeSeriesDataFetcher:
     
     def parse_time(self, time_str: str) -> datetime:
         """解析时间字符串为datetime对象"""
-        from config import TIME_FORMATS
-        
         if isinstance(time_str, datetime):
             return time_str
-            
-        for fmt in TIME_FORMATS:
-            try:
-                dt = datetime.strptime(time_str, fmt)
-                # 确保时区感知
-                if dt.tzinfo is None:
-                    dt = dt.replace(tzinfo=timezone.utc)
-                return dt
-            except ValueError:
-                continue
         
-        raise ValueError(f"无法解析时间格式: {time_str}")
+        return _parse_time_cached(time_str)
     
-    def generate_time_windows(self, 
-                            start_time: Union[str, datetime], 
-                            end_time: Union[str, datetime]) -> List[tuple]:
-        """生成时间窗口列表"""
+    def iter_time_windows(self, 
+                          start_time: Union[str, datetime], 
+                          end_time: Union[str, datetime],
+                          interval_minutes: Optional[float] = None) -> Iterator[tuple]:
+        """按固定间隔（默认 time_interval_minutes）逐个产出时间窗口，不预先生成整个列表"""
         start_dt = self.parse_time(start_time)
         end_dt = self.parse_time(end_time)
+        interval = timedelta(minutes=interval_minutes or self.time_interval_minutes)
         
-        windows = []
         current_time = start_dt
         
         while current_time < end_dt:
-            window_end = min(
-                current_time + timedelta(minutes=self.time_interval_minutes),
-                end_dt
-            )
-            windows.append((current_time, window_end))
+            window_end = min(current_time + interval, end_dt)
+            yield current_time, window_end
             current_time = window_end
-            
-        logger.info(f"生成了 {len(windows)} 个时间窗口")
+    
+    def generate_time_windows(self, 
+                            start_time: Union[str, datetime], 
+                            end_time: Union[str, datetime],
+                            interval_minutes: Optional[float] = None) -> List[tuple]:
+        """生成时间窗口列表（范围较大时优先使用 iter_time_windows）"""
+        windows = list(self.iter_time_windows(start_time, end_time, interval_minutes))
+        logger.debug(f"生成了 {len(windows)} 个时间窗口")
         return windows
     
+    def create_window_planner(self, 
+                              start_time: Union[str, datetime], 
+                              end_time: Union[str, datetime],
+                              buckets: Optional[List[tuple]] = None,
+                              chunk_size: Optional[int] = None,
+                              interval_minutes: Optional[float] = None) -> AdaptiveWindowPlanner:
+        """
+        创建自适应时间窗口规划器，目标为每个窗口约 adaptive_target_chunks 个数据块
+        
+        Args:
+            buckets: probe() 返回的时间桶，桶宽为 interval_minutes；为None时根据反馈调整
+            chunk_size: 数据块大小，默认 self.chunk_size
+            interval_minutes: 初始窗口间隔，默认 self.time_interval_minutes
+        """
+        interval_minutes = interval_minutes or self.time_interval_minutes
+        return AdaptiveWindowPlanner(
+            start_dt=self.parse_time(start_time),
+            end_dt=self.parse_time(end_time),
+            initial_minutes=interval_minutes,
+            target_rows=DEFAULT_CONFIG["adaptive_target_chunks"] * (chunk_size or self.chunk_size),
+            min_minutes=DEFAULT_CONFIG["min_interval_minutes"],
+            max_minutes=DEFAULT_CONFIG["max_interval_minutes"],
+            buckets=buckets,
+            bucket_minutes=interval_minutes
+        )
+    
+    async def get_table_columns(self, table_name: str) -> frozenset:
+        """获取表的全部字段名（首次查询information_schema后缓存）"""
+        if table_name not in TABLE_CONFIGS:
+            raise ValueError(f"不支持的表: {table_name}")
+        
+        columns = self._columns_cache.get(table_name)
+        if columns is None:
+            query = """
+                SELECT column_name
+                FROM information_schema.columns
+                WHERE table_schema = ANY(current_schemas(false)) AND table_name = $1
+            """
+            async with self._acquire() as conn:
+                rows = await conn.fetch(query, table_name)
+            
+            if not rows:
+                raise ValueError(f"表不存在: {table_name}")
+            
+            columns = frozenset(row["column_name"] for row in rows)
+            self._columns_cache[table_name] = columns
+        
+        return columns
+    
+    async def _validate_columns(self, table_name: str, fields: List[str]):
+        """校验字段名是否都属于该表"""
+        columns = await self.get_table_columns(table_name)
+        unknown = [f for f in fields if f not in columns]
+        if unknown:
+            raise ValueError(f"表 {table_name} 不存在字段: {', '.join(unknown)}")
+    
+    async def _build_where_clause(self,
+                                  table_name: str,
+                                  where_conditions: Optional[WhereConditions],
+                                  first_index: int) -> str:
+        """
+        构建附加在时间范围条件之后的筛选条件
+        
+        字符串原样拼接；dict形式的条件校验字段名后生成参数占位符，从 $first_index 开始编号；
+        元组形式的条件模板中的占位符重新编号为从 $first_index 开始
+        """
+        if not where_conditions:
+            return ""
+        if isinstance(where_conditions, str):
+            return f" AND ({where_conditions})"
+        if isinstance(where_conditions, tuple):
+            return f" AND ({_renumber_placeholders(where_conditions[0], first_index)})"
+        
+        parsed = [_parse_where_key(key) for key in where_conditions]
+        await self._validate_columns(table_name, [column for column, _ in parsed])
+        
+        return "".join(
+            f" AND {_quote_ident(column)} {op} ${i}"
+            for i, (column, op) in enumerate(parsed, first_index)
+        )
+    
+    async def prepared_filter(self,
+                              table_name: str,
+                              select_fields: Optional[List[str]],
+                              predicate_template: str) -> PreparedFilter:
+        """
+        创建参数化的筛选查询
+        
+        Args:
+            predicate_template: 条件模板，参数用 $1, $2... 表示，例如 "user_id = $1 AND likes > $2"；
+                                占位符会自动排在时间范围参数之后。模板中的SQL需可信
+        """
+        if table_name not in TABLE_CONFIGS:
+            raise ValueError(f"不支持的表: {table_name}")
+        
+        indexes = {int(i) for i in _PLACEHOLDER_RE.findall(predicate_template)}
+        if indexes != set(range(1, len(indexes) + 1)):
+            raise ValueError(f"条件模板的占位符必须从 $1 开始连续编号: {predicate_template}")
+        
+        # 提前构建并缓存查询，字段名在这里校验
+        await self._build_select_query(
+            table_name, (predicate_template, ()), select_fields
+        )
+        return PreparedFilter(self, table_name, select_fields, predicate_template, len(indexes))
+    
+    async def aggregate(self,
+                        table_name: str,
+                        start_time: Union[str, datetime],
+                        end_time: Union[str, datetime],
+                        aggs: Dict[str, str],
+                        where_conditions: Optional[WhereConditions] = None) -> Dict[str, Any]:
+        """
+        在数据库端计算聚合值，一次查询返回所有结果，不把记录拉到Python中
+        
+        Args:
+            aggs: 结果名 -> 聚合表达式，例如 {"total_count": "COUNT(*)", "max_likes": "MAX(likes)"}；
+                  表达式原样拼接到SQL中，只应使用可信的输入（结果名会校验并加引号）
+        
+        Returns:
+            结果名 -> 聚合值
+        """
+        if table_name not in TABLE_CONFIGS:
+            raise ValueError(f"不支持的表: {table_name}")
+        if not aggs:
+            raise ValueError("至少需要一个聚合表达式")
+        
+        for alias in aggs:
+            if not alias.isidentifier():
+                raise ValueError(f"无效的聚合结果名: {alias}")
+        
+        config = TABLE_CONFIGS[table_name]
+        time_field = _quote_ident(config["time_field"])
+        
+        start_dt = self.parse_time(start_time)
+        end_dt = self.parse_time(end_time)
+        
+        select_clause = ", ".join(f"{expr} AS {_quote_ident(alias)}" for alias, expr in aggs.items())
+        query = f"""
+            SELECT {select_clause}
+            FROM {_quote_ident(table_name)}
+            WHERE {time_field} >= $1 AND {time_field} < $2
+        """
+        query += await self._build_where_clause(table_name, where_conditions, 3)
+        
+        async with self._acquire() as conn:
+            result = await conn.fetchrow(query, start_dt, end_dt, *_where_args(where_conditions))
+            return dict(result)
+    
     async def get_table_count(self, 
                             table_name: str,
                             start_time: Union[str, datetime],
                             end_time: Union[str, datetime],
-                            where_conditions: Optional[str] = None) -> int:
+                            where_conditions: Optional[WhereConditions] = None) -> int:
         """获取指定时间范围内的记录总数"""
+        result = await self.aggregate(
+            table_name, start_time, end_time,
+            {"total_count": "COUNT(*)"}, where_conditions
+        )
+        return result["total_count"]
+    
+    async def estimate_counts(self,
+                              table_names: List[str],
+                              start_time: Union[str, datetime],
+                              end_time: Union[str, datetime]) -> Dict[str, int]:
+        """
+        一次查询统计多个表在时间范围内的记录数
+        
+        各表的COUNT以UNION ALL合并为一条语句，只需一次往返，可用于提前跳过无数据的表。
+        
+        Returns:
+            表名 -> 记录数（顺序与table_names一致）
+        """
+        if not table_names:
+            return {}
+        for table_name in table_names:
+            if table_name not in TABLE_CONFIGS:
+                raise ValueError(f"不支持的表: {table_name}")
+        
+        start_dt = self.parse_time(start_time)
+        end_dt = self.parse_time(end_time)
+        
+        parts = []
+        for i, table_name in enumerate(table_names):
+            time_field = _quote_ident(TABLE_CONFIGS[table_name]["time_field"])
+            parts.append(f"""
+            SELECT {i} AS table_index, COUNT(*) AS count
+            FROM {_quote_ident(table_name)}
+            WHERE {time_field} >= $1 AND {time_field} < $2
+            """)
+        query = " UNION ALL ".join(parts)
+        
+        async with self._acquire() as conn:
+            rows = await conn.fetch(query, start_dt, end_dt)
+        
+        counts = {row["table_index"]: row["count"] for row in rows}
+        return {table_name: counts[i] for i, table_name in enumerate(table_names)}
+    
+    async def batch_counts(self,
+                           table_name: str,
+                           windows: List[tuple],
+                           where_conditions: Optional[WhereConditions] = None) -> List[int]:
+        """
+        一次查询统计多个连续时间窗口各自的记录数
+        
+        Args:
+            windows: [(开始时间, 结束时间), ...]，按时间排序且首尾相接，
+                     例如 generate_time_windows() 的结果
+        
+        Returns:
+            与windows一一对应的记录数
+        """
         if table_name not in TABLE_CONFIGS:
             raise ValueError(f"不支持的表: {table_name}")
+        if not windows:
+            return []
         
-        config = TABLE_CONFIGS[table_name]
-        time_field = config["time_field"]
+        windows = [(self.parse_time(start), self.parse_time(end)) for start, end in windows]
+        for (_, prev_end), (next_start, _) in zip(windows, windows[1:]):
+            if prev_end != next_start:
+                raise ValueError(f"时间窗口必须连续: {prev_end} != {next_start}")
+        
+        time_field = _quote_ident(TABLE_CONFIGS[table_name]["time_field"])
+        where_args = _where_args(where_conditions)
+        thresholds_index = 3 + len(where_args)
+        
+        # 以各窗口的开始时间为分界点，width_bucket返回记录所在窗口的序号（从1开始）
+        query = f"""
+            SELECT width_bucket({time_field}::timestamptz, ${thresholds_index}::timestamptz[]) AS bucket,
+                   COUNT(*) AS count
+            FROM {_quote_ident(table_name)}
+            WHERE {time_field} >= $1 AND {time_field} < $2
+        """
+        query += await self._build_where_clause(table_name, where_conditions, 3)
+        query += " GROUP BY bucket"
+        
+        thresholds = [start for start, _ in windows]
+        
+        async with self._acquire() as conn:
+            rows = await conn.fetch(query, windows[0][0], windows[-1][1], *where_args, thresholds)
+        
+        counts = {row["bucket"]: row["count"] for row in rows}
+        return [counts.get(i, 0) for i in range(1, len(windows) + 1)]
+    
+    async def probe(self,
+                    table_name: str,
+                    start_time: Union[str, datetime],
+                    end_time: Union[str, datetime],
+                    where_conditions: Optional[WhereConditions] = None,
+                    bucket_minutes: Optional[float] = None) -> Dict[str, Any]:
+        """
+        一次查询获取时间范围内的数据分布
+        
+        按 bucket_minutes（默认 time_interval_minutes）从 start_time 开始划分时间桶并分组计数，
+        总数和最早/最晚时间由各桶汇总得出，不需要额外的查询。
+        
+        Returns:
+            {"count": 总记录数, "tmin": 最早时间, "tmax": 最晚时间,
+             "buckets": [(时间桶开始时间, 记录数), ...]}（只包含非空桶，按时间排序）
+        """
+        if table_name not in TABLE_CONFIGS:
+            raise ValueError(f"不支持的表: {table_name}")
         
         start_dt = self.parse_time(start_time)
         end_dt = self.parse_time(end_time)
+        bucket_width = timedelta(minutes=bucket_minutes or self.time_interval_minutes)
+        
+        time_field = _quote_ident(TABLE_CONFIGS[table_name]["time_field"])
+        where_args = _where_args(where_conditions)
+        width_index = 3 + len(where_args)
         
         query = f"""
-            SELECT COUNT(*) as total_count
-            FROM {table_name}
+            SELECT FLOOR(EXTRACT(EPOCH FROM ({time_field}::timestamptz - $1)) / ${width_index})::bigint AS bucket,
+                   COUNT(*) AS count,
+                   MIN({time_field}) AS tmin,
+                   MAX({time_field}) AS tmax
+            FROM {_quote_ident(table_name)}
             WHERE {time_field} >= $1 AND {time_field} < $2
         """
+        query += await self._build_where_clause(table_name, where_conditions, 3)
+        query += " GROUP BY bucket ORDER BY bucket"
         
-        if where_conditions:
-            query += f" AND ({where_conditions})"
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                query, start_dt, end_dt, *where_args, bucket_width.total_seconds()
+            )
         
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchrow(query, start_dt, end_dt)
-            return result['total_count']
+        return {
+            "count": sum(row["count"] for row in rows),
+            "tmin": rows[0]["tmin"] if rows else None,
+            "tmax": rows[-1]["tmax"] if rows else None,
+            "buckets": [(start_dt + bucket_width * row["bucket"], row["count"]) for row in rows]
+        }
     
-    async def fetch_data_chunk(self, 
-                             table_name: str,
-                             start_time: Union[str, datetime],
-                             end_time: Union[str, datetime],
-                             offset: int = 0,
-                             limit: int = None,
-                             where_conditions: Optional[str] = None,
-                             select_fields: Optional[List[str]] = None) -> List[Dict]:
-        """获取单个数据块"""
+    async def window_histogram(self,
+                               table_name: str,
+                               start_time: Union[str, datetime],
+                               end_time: Union[str, datetime],
+                               interval_minutes: Optional[float] = None,
+                               where_conditions: Optional[WhereConditions] = None) -> Dict[int, int]:
+        """
+        一次查询统计每个固定时间窗口的记录数
+        
+        窗口从 start_time 开始按 interval_minutes（默认 time_interval_minutes）划分，
+        序号与 stream_data_by_time_windows 的 window_index 一致（从1开始）。
+        
+        Returns:
+            窗口序号 -> 记录数（只包含非空窗口）
+        """
+        start_dt = self.parse_time(start_time)
+        width = timedelta(minutes=interval_minutes or self.time_interval_minutes)
+        
+        distribution = await self.probe(
+            table_name, start_dt, end_time, where_conditions, bucket_minutes=interval_minutes
+        )
+        return {
+            (bucket_start - start_dt) // width + 1: count
+            for bucket_start, count in distribution["buckets"]
+        }
+    
+    async def _build_select_query(self,
+                                  table_name: str,
+                                  where_conditions: Optional[WhereConditions] = None,
+                                  select_fields: Optional[List[str]] = None,
+                                  paginated: bool = False,
+                                  keyset: bool = False) -> str:
+        """
+        构建按排序字段排序的SELECT查询
+        
+        参数顺序：$1/$2为时间范围，随后是参数化筛选条件的值；
+        keyset为True时再追加键集分页条件（上一块最后一条记录的排序字段值）；
+        paginated为True时确保排序字段出现在结果中，并以最后一个参数作为LIMIT。
+        
+        未指定select_fields时使用表配置中的default_projection；select_fields为["*"]时选择全部字段。
+        
+        字段名在首次构建时按表结构校验并加引号。同一查询形状总是得到相同的SQL文本，
+        asyncpg会按SQL文本在每个连接上缓存预处理语句，因此每个连接对每种查询只需解析/规划一次。
+        """
+        cache_key = (
+            table_name, tuple(select_fields) if select_fields else None,
+            _where_shape(where_conditions), paginated, keyset
+        )
+        query = self._query_cache.get(cache_key)
+        if query is not None:
+            return query
+        
         if table_name not in TABLE_CONFIGS:
             raise ValueError(f"不支持的表: {table_name}")
         
         config = TABLE_CONFIGS[table_name]
-        time_field = config["time_field"]
+        time_field = _quote_ident(config["time_field"])
         order_fields = config["order_fields"]
         
-        start_dt = self.parse_time(start_time)
-        end_dt = self.parse_time(end_time)
-        limit = limit or self.chunk_size
+        # 构建SELECT字段，只取需要的列可以减少传输和解码的数据量
+        if not select_fields:
+            select_fields = config.get("default_projection")
+            if not select_fields:
+                logger.warning(f"表 {table_name} 未指定select_fields，将获取全部字段")
+        elif list(select_fields) == ["*"]:
+            select_fields = None
         
-        # 构建SELECT字段
-        fields = ", ".join(select_fields) if select_fields else "*"
+        if select_fields:
+            await self._validate_columns(table_name, select_fields)
+            fields = list(select_fields)
+            if paginated:
+                fields += [f for f in order_fields if f not in select_fields]
+            fields = ", ".join(_quote_ident(f) for f in fields)
+        else:
+            fields = "*"
         
         # 构建查询
         query = f"""
             SELECT {fields}
-            FROM {table_name}
+            FROM {_quote_ident(table_name)}
             WHERE {time_field} >= $1 AND {time_field} < $2
         """
+        query += await self._build_where_clause(table_name, where_conditions, 3)
         
-        if where_conditions:
-            query += f" AND ({where_conditions})"
+        next_index = 3 + len(_where_args(where_conditions))
+        order_clause = ", ".join(_quote_ident(f) for f in order_fields)
+        
+        # 从上一块的最后一条记录之后继续（行值比较可直接利用排序字段上的复合索引）
+        if keyset:
+            placeholders = ", ".join(
+                f"${i}" for i in range(next_index, next_index + len(order_fields))
+            )
+            query += f" AND ({order_clause}) > ({placeholders})"
+            next_index += len(order_fields)
         
         # 添加排序
-        order_clause = ", ".join(order_fields)
         query += f" ORDER BY {order_clause}"
         
-        # 添加分页
-        query += f" LIMIT {limit} OFFSET {offset}"
+        # LIMIT也作为参数传入，避免不同块大小产生不同的SQL文本
+        if paginated:
+            query += f" LIMIT ${next_index}"
         
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch(query, start_dt, end_dt)
-            return [dict(row) for row in rows]
+        self._query_cache[cache_key] = query
+        return query
+    
+    async def _result_schema(self,
+                             table_name: str,
+                             where_conditions: Optional[WhereConditions] = None,
+                             select_fields: Optional[List[str]] = None,
+                             paginated: bool = False) -> pa.Schema:
+        """
+        查询结果的Arrow schema，由数据库报告的列类型得到（按SQL文本缓存）
+        
+        参数与 _build_select_query 相同；各数据块都按这个schema构建，类型不依赖某一块的数据。
+        """
+        query = await self._build_select_query(table_name, where_conditions, select_fields,
+                                               paginated=paginated)
+        schema = self._schema_cache.get(query)
+        if schema is None:
+            async with self._acquire() as conn:
+                statement = await conn.prepare(query)
+            schema = _attributes_schema(statement.get_attributes())
+            self._schema_cache[query] = schema
+        return schema
+    
+    async def fetch_data_chunk(self, 
+                             table_name: str,
+                             start_time: Union[str, datetime],
+                             end_time: Union[str, datetime],
+                             after: Optional[tuple] = None,
+                             limit: int = None,
+                             where_conditions: Optional[WhereConditions] = None,
+                             select_fields: Optional[List[str]] = None,
+                             conn: Optional[asyncpg.Connection] = None) -> List[asyncpg.Record]:
+        """
+        获取单个数据块（键集分页）
+        
+        返回asyncpg记录，可像dict一样按字段名访问，需要dict时再用dict(record)转换
+        
+        Args:
+            after: 上一块最后一条记录的排序字段值，按order_fields顺序；为None时从头开始
+            conn: 已获取的数据库连接；为None时从连接池临时获取
+        
+        注意：排序字段用于键集分页，如果select_fields中未包含会被自动追加
+        """
+        start_dt = self.parse_time(start_time)
+        end_dt = self.parse_time(end_time)
+        limit = limit or self.chunk_size
+        
+        query = await self._build_select_query(
+            table_name, where_conditions, select_fields,
+            paginated=True, keyset=after is not None
+        )
+        
+        args = [start_dt, end_dt, *_where_args(where_conditions)]
+        if after is not None:
+            args.extend(after)
+        args.append(limit)
+        
+        if conn is not None:
+            rows = await conn.fetch(query, *args)
+        else:
+            async with self._acquire() as conn:
+                rows = await conn.fetch(query, *args)
+        return rows
+    
+    def _build_metadata(self, table_name: str) -> Optional[Dict]:
+        """
+        构建数据块的元数据，每次流式获取只构建一次，由该次产出的所有数据块共享
+        
+        include_metadata为False时返回None，数据块中不包含metadata字段
+        """
+        if not self.include_metadata:
+            return None
+        
+        return {
+            "table_name": table_name,
+            "time_field": TABLE_CONFIGS[table_name]["time_field"],
+            "query_time": datetime.now(timezone.utc).isoformat()
+        }
+    
+    def _next_key(self, table_name: str, row: asyncpg.Record) -> tuple:
+        """提取记录的排序字段值，作为下一块的分页起点"""
+        return tuple(row[f] for f in TABLE_CONFIGS[table_name]["order_fields"])
+    
+    async def iter_window_chunks(self,
+                                 conn: asyncpg.Connection,
+                                 table_name: str,
+                                 start_time: Union[str, datetime],
+                                 end_time: Union[str, datetime],
+                                 where_conditions: Optional[WhereConditions] = None,
+                                 select_fields: Optional[List[str]] = None,
+                                 chunk_size: Optional[int] = None) -> AsyncGenerator[List[asyncpg.Record], None]:
+        """
+        使用服务端游标按块读取一个时间范围的数据
+        
+        整个范围只执行一次查询（一次解析/规划、一次有序扫描），
+        游标每次预取 chunk_size（默认 self.chunk_size）条记录。游标需要在事务内使用，因此会占用 conn 直到读取完毕。
+        """
+        chunk_size = chunk_size or self.chunk_size
+        start_dt = self.parse_time(start_time)
+        end_dt = self.parse_time(end_time)
+        query = await self._build_select_query(table_name, where_conditions, select_fields)
+        args = [start_dt, end_dt, *_where_args(where_conditions)]
+        
+        async with conn.transaction(readonly=True):
+            chunk_data = []
+            async for record in conn.cursor(query, *args, prefetch=chunk_size):
+                chunk_data.append(record)
+                if len(chunk_data) >= chunk_size:
+                    yield chunk_data
+                    chunk_data = []
+            
+            if chunk_data:
+                yield chunk_data
+    
+    async def _fetch_window(self,
+                            table_name: str,
+                            window_start: datetime,
+                            window_end: datetime,
+                            where_conditions: Optional[WhereConditions],
+                            select_fields: Optional[List[str]],
+                            queue: asyncio.Queue,
+                            chunk_size: Optional[int] = None,
+                            previous_acquired: Optional[asyncio.Event] = None,
+                            acquired: Optional[asyncio.Event] = None):
+        """
+        在独立连接上获取一个时间窗口的全部数据块，依次放入队列，以None结束
+        
+        等前一个窗口取得连接（previous_acquired）后才获取连接，取得后设置 acquired。
+        连接因此按窗口顺序分配：只要本次流占有连接，最早的窗口就一定占有一个，
+        不会出现后面的窗口占满连接、而消费方等待的最早窗口拿不到连接的死锁。
+        """
+        try:
+            try:
+                if previous_acquired is not None:
+                    await previous_acquired.wait()
+                
+                # 任务被取消时先关闭生成器（结束游标所在的事务），再把连接归还连接池
+                async with self._acquire() as conn, aclosing(self.iter_window_chunks(
+                    conn, table_name, window_start, window_end, where_conditions, select_fields,
+                    chunk_size
+                )) as chunks:
+                    if acquired is not None:
+                        acquired.set()
+                    
+                    async for chunk_data in chunks:
+                        # 队列有界，消费方处理慢时会在这里等待
+                        await queue.put(chunk_data)
+                        
+                        if self.pace_seconds:
+                            await asyncio.sleep(self.pace_seconds)
+            finally:
+                # 出错或被取消时同样放行下一个窗口
+                if acquired is not None:
+                    acquired.set()
+        except Exception as e:
+            # 异常交给消费方抛出
+            await queue.put(e)
+            return
+        
+        await queue.put(None)
     
     async def stream_data_by_time_windows(self, 
                                         table_name: str,
                                         start_time: Union[str, datetime],
                                         end_time: Union[str, datetime],
-                                        where_conditions: Optional[str] = None,
-                                        select_fields: Optional[List[str]] = None) -> AsyncGenerator[Dict, None]:
-        """按时间窗口流式获取数据"""
-        windows = self.generate_time_windows(start_time, end_time)
-        total_records = 0
+                                        where_conditions: Optional[WhereConditions] = None,
+                                        select_fields: Optional[List[str]] = None,
+                                        only_windows: Optional[Iterable[int]] = None,
+                                        return_format: str = "records",
+                                        chunk_size: Optional[int] = None,
+                                        time_interval_minutes: Optional[float] = None) -> AsyncGenerator[Chunk, None]:
+        """
+        按时间窗口流式获取数据
         
-        for i, (window_start, window_end) in enumerate(windows, 1):
-            logger.info(f"处理时间窗口 {i}/{len(windows)}: {window_start} ~ {window_end}")
-            
-            # 获取当前窗口的记录数
-            window_count = await self.get_table_count(
-                table_name, window_start, window_end, where_conditions
+        最多 max_connections 个时间窗口在各自的连接上并发获取，
+        数据块仍按时间窗口顺序产出。
+        
+        Args:
+            only_windows: 只查询这些序号的窗口（例如 window_histogram() 中的非空窗口），
+                          其余窗口不发出查询；仅适用于固定时间窗口
+            return_format: "records" 时 data 为asyncpg记录列表；"arrow" 时数据块另含
+                           batch（pyarrow.RecordBatch），data 为按需转换行的只读视图
+            chunk_size: 本次调用的数据块大小，默认使用构造时的设置
+            time_interval_minutes: 本次调用的时间窗口间隔，默认使用构造时的设置
+        """
+        _check_return_format(return_format)
+        start_time = self.parse_time(start_time)
+        end_time = self.parse_time(end_time)
+        chunk_size = chunk_size or self.chunk_size
+        interval_minutes = time_interval_minutes or self.time_interval_minutes
+        
+        if only_windows is not None and self.adaptive_windows:
+            raise ValueError("only_windows 仅适用于固定时间窗口")
+        
+        # 先构建查询（首次需要查询表结构），窗口任务持有连接时不必再去获取另一个连接
+        await self._build_select_query(table_name, where_conditions, select_fields)
+        schema = (await self._result_schema(table_name, where_conditions, select_fields)
+                  if return_format == "arrow" else None)
+        
+        if self.adaptive_windows:
+            # 一次查询获取数据分布，据此规划窗口并跳过无数据的时间段
+            distribution = await self.probe(
+                table_name, start_time, end_time, where_conditions, bucket_minutes=interval_minutes
             )
+            logger.info(f"共 {distribution['count']} 条记录，"
+                        f"分布在 {len(distribution['buckets'])} 个非空时间段")
+            planner = self.create_window_planner(
+                start_time, end_time, distribution["buckets"], chunk_size, interval_minutes
+            )
+            windows = iter(planner)
+        else:
+            planner = None
+            windows = self.iter_time_windows(start_time, end_time, interval_minutes)
+        
+        # 窗口序号始终按完整的窗口序列编号，跳过的窗口不影响其余窗口的序号
+        indexed_windows = enumerate(windows, 1)
+        if only_windows is not None:
+            only_windows = frozenset(only_windows)
+            indexed_windows = (item for item in indexed_windows if item[0] in only_windows)
+        
+        metadata = self._build_metadata(table_name)
+        
+        # 进行中的时间窗口: (窗口索引, 开始时间, 结束时间, 数据块队列, 任务)
+        pending = deque()
+        # 最近启动的窗口取得连接后设置，下一个窗口等它之后才获取连接
+        last_acquired = None
+        
+        def launch_next_window() -> bool:
+            nonlocal last_acquired
+            item = next(indexed_windows, None)
+            if item is None:
+                return False
             
-            if window_count == 0:
-                logger.info(f"时间窗口 {i} 无数据，跳过")
-                continue
-            
-            logger.info(f"时间窗口 {i} 共有 {window_count} 条记录")
-            
-            # 分块获取当前窗口的数据
-            offset = 0
-            window_records = 0
+            window_index, (window_start, window_end) = item
+            # 每个窗口最多预取2个数据块，消费方处理慢时生产方会在put处等待
+            queue = asyncio.Queue(maxsize=2)
+            acquired = asyncio.Event()
+            task = asyncio.create_task(self._fetch_window(
+                table_name, window_start, window_end, where_conditions, select_fields, queue,
+                chunk_size, last_acquired, acquired
+            ))
+            last_acquired = acquired
+            pending.append((window_index, window_start, window_end, queue, task))
+            return True
+        
+        total_records = 0
+        
+        try:
+            for _ in range(self.max_connections):
+                if not launch_next_window():
+                    break
             
-            while offset < window_count:
-                chunk_data = await self.fetch_data_chunk(
-                    table_name=table_name,
-                    start_time=window_start,
-                    end_time=window_end,
-                    offset=offset,
-                    limit=self.chunk_size,
-                    where_conditions=where_conditions,
-                    select_fields=select_fields
-                )
+            while pending:
+                i, window_start, window_end, queue, _ = pending[0]
+                logger.info(f"处理时间窗口 {i}: {window_start} ~ {window_end}")
                 
-                if not chunk_data:
-                    break
+                window_records = 0
                 
-                chunk_size = len(chunk_data)
-                window_records += chunk_size
-                total_records += chunk_size
+                while True:
+                    chunk_data = await queue.get()
+                    
+                    if chunk_data is None:
+                        break
+                    if isinstance(chunk_data, Exception):
+                        raise chunk_data
+                    
+                    # 不能复用chunk_size：后续窗口仍按它设置每块的大小
+                    rows = len(chunk_data)
+                    chunk_offset = window_records
+                    window_records += rows
+                    total_records += rows
+                    
+                    # 产出数据块
+                    chunk = Chunk(
+                        window_index=i,
+                        window_start=window_start.isoformat(),
+                        window_end=window_end.isoformat(),
+                        chunk_offset=chunk_offset,
+                        chunk_size=rows,
+                        window_records=window_records,
+                        total_records_so_far=total_records,
+                        data=chunk_data,
+                        metadata=metadata
+                    )
+                    if return_format == "arrow":
+                        _attach_batch(chunk, schema, self.column_dtypes)
+                    yield chunk
                 
-                # 产出数据块
-                yield {
-                    "window_index": i,
-                    "window_start": window_start.isoformat(),
-                    "window_end": window_end.isoformat(),
-                    "chunk_offset": offset,
-                    "chunk_size": chunk_size,
-                    "total_records_so_far": total_records,
-                    "data": chunk_data,
-                    "metadata": {
-                        "table_name": table_name,
-                        "time_field": TABLE_CONFIGS[table_name]["time_field"],
-                        "query_time": datetime.now(timezone.utc).isoformat()
-                    }
-                }
+                if window_records == 0:
+                    logger.info(f"时间窗口 {i} 无数据，跳过")
+                else:
+                    logger.info(f"时间窗口 {i} 完成，实际获取 {window_records} 条记录")
                 
-                offset += self.chunk_size
+                pending.popleft()
                 
-                # 防止内存溢出，添加短暂休息
-                if chunk_size >= self.chunk_size:
-                    await asyncio.sleep(0.01)
-            
-            logger.info(f"时间窗口 {i} 完成，实际获取 {window_records} 条记录")
+                # 根据当前窗口的数据密度调整后续窗口的大小
+                if planner is not None:
+                    planner.observe(window_start, window_end, window_records)
+                
+                launch_next_window()
+        finally:
+            # 提前退出或出错时取消尚未完成的窗口任务
+            tasks = [item[-1] for item in pending]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
         
         logger.info(f"所有时间窗口处理完成，总计 {total_records} 条记录")
     
@@ -242,77 +1287,244 @@ class TimeSeriesDataFetcher:
                                   table_name: str,
                                   start_time: Union[str, datetime],
                                   end_time: Union[str, datetime],
-                                  where_conditions: Optional[str] = None,
-                                  select_fields: Optional[List[str]] = None) -> AsyncGenerator[Dict, None]:
-        """按记录数分块流式获取数据（不按时间窗口划分）"""
-        total_count = await self.get_table_count(
-            table_name, start_time, end_time, where_conditions
-        )
+                                  where_conditions: Optional[WhereConditions] = None,
+                                  select_fields: Optional[List[str]] = None,
+                                  return_format: str = "records",
+                                  chunk_size: Optional[int] = None,
+                                  total_count: Optional[int] = None) -> AsyncGenerator[Chunk, None]:
+        """
+        按记录数分块流式获取数据（不按时间窗口划分）
         
-        if total_count == 0:
+        return_format、chunk_size 的含义与 stream_data_by_time_windows 相同
+        
+        Args:
+            total_count: 已知的记录总数（例如来自 estimate_counts()），传入时不再查询总数
+        """
+        _check_return_format(return_format)
+        start_time = self.parse_time(start_time)
+        end_time = self.parse_time(end_time)
+        limit = chunk_size or self.chunk_size
+        schema = (await self._result_schema(table_name, where_conditions, select_fields, paginated=True)
+                  if return_format == "arrow" else None)
+        
+        async def fetch_after(after: Optional[tuple]) -> List[asyncpg.Record]:
+            return await self.fetch_data_chunk(
+                table_name=table_name,
+                start_time=start_time,
+                end_time=end_time,
+                after=after,
+                limit=limit,
+                where_conditions=where_conditions,
+                select_fields=select_fields
+            )
+        
+        if total_count is None:
+            # 总数查询与第一块数据的查询并发执行，各自使用一个连接
+            count_task = asyncio.create_task(self.get_table_count(
+                table_name, start_time, end_time, where_conditions
+            ))
+            try:
+                chunk_data = await fetch_after(None)
+                total_count = await count_task
+            finally:
+                # 第一块出错时取消总数查询，并等它结束、归还连接后再退出
+                if not count_task.done():
+                    count_task.cancel()
+                await asyncio.gather(count_task, return_exceptions=True)
+        elif total_count == 0:
+            chunk_data = []
+        else:
+            chunk_data = await fetch_after(None)
+        
+        if total_count == 0 or not chunk_data:
             logger.info("没有找到符合条件的数据")
             return
         
         logger.info(f"总共需要获取 {total_count} 条记录")
         
+        metadata = self._build_metadata(table_name)
+        
         offset = 0
         chunk_index = 0
         
-        while offset < total_count:
-            chunk_data = await self.fetch_data_chunk(
-                table_name=table_name,
-                start_time=start_time,
-                end_time=end_time,
-                offset=offset,
-                limit=self.chunk_size,
-                where_conditions=where_conditions,
-                select_fields=select_fields
+        while chunk_data:
+            chunk_index += 1
+            chunk_size = len(chunk_data)
+            
+            chunk = Chunk(
+                chunk_index=chunk_index,
+                chunk_offset=offset,
+                chunk_size=chunk_size,
+                total_count=total_count,
+                progress=min((offset + chunk_size) / total_count, 1.0),
+                data=chunk_data,
+                metadata=metadata
             )
+            if return_format == "arrow":
+                _attach_batch(chunk, schema, self.column_dtypes)
+            yield chunk
             
-            if not chunk_data:
+            offset += chunk_size
+            
+            if chunk_size < limit:
                 break
             
-            chunk_index += 1
-            chunk_size = len(chunk_data)
+            after = self._next_key(table_name, chunk_data[-1])
             
-            yield {
-                "chunk_index": chunk_index,
-                "chunk_offset": offset,
-                "chunk_size": chunk_size,
-                "total_count": total_count,
-                "progress": (offset + chunk_size) / total_count,
-                "data": chunk_data,
-                "metadata": {
-                    "table_name": table_name,
-                    "time_field": TABLE_CONFIGS[table_name]["time_field"],
-                    "query_time": datetime.now(timezone.utc).isoformat()
-                }
-            }
+            if self.pace_seconds:
+                await asyncio.sleep(self.pace_seconds)
             
-            offset += self.chunk_size
-            await asyncio.sleep(0.01)  # 防止过度占用资源
+            chunk_data = await fetch_after(after)
         
         logger.info(f"数据获取完成，共 {chunk_index} 个块")
     
-    def format_output(self, data: Dict, output_format: str) -> str:
-        """格式化输出数据"""
+    def format_output(self, data: Union[Chunk, Dict], output_format: str, include_header: bool = True) -> str:
+        """
+        格式化输出数据
+        
+        Args:
+            include_header: CSV格式是否包含表头，逐块输出时只有第一块需要
+        """
         if output_format == "json":
-            return json.dumps(data, ensure_ascii=False, indent=2, default=str)
+            return _json_dumps(data, indent=True).decode()
         elif output_format == "jsonl":
-            return json.dumps(data, ensure_ascii=False, default=str)
+            return _json_dumps(data).decode()
         elif output_format == "csv":
             if not data.get("data"):
                 return ""
             
             # 将数据转换为CSV格式
-            df = pd.DataFrame(data["data"])
-            return df.to_csv(index=False)
+            table = _csv_compatible(_records_to_arrow(data["data"]))
+            buf = pa.BufferOutputStream()
+            pacsv.write_csv(table, buf, write_options=pacsv.WriteOptions(
+                include_header=include_header, quoting_style="needed"
+            ))
+            return buf.getvalue().to_pybytes().decode()
         elif output_format == "parquet":
             # 这里返回文件路径，实际写入由调用者处理
             return "parquet"
         else:
             raise ValueError(f"不支持的输出格式: {output_format}")
     
+    async def fetch_table(self,
+                          table_name: str,
+                          start_time: Union[str, datetime],
+                          end_time: Union[str, datetime],
+                          where_conditions: Optional[WhereConditions] = None,
+                          select_fields: Optional[List[str]] = None,
+                          **options) -> pa.Table:
+        """
+        按时间窗口获取整个时间范围的数据，合并为一个Arrow表
+        
+        需要把同一批数据写成多种格式时，只需查询一次数据库。列类型取自数据库，
+        没有数据时返回带有这些列的空表；options（如 chunk_size）传给 stream_data_by_time_windows。
+        """
+        schema = await self._result_schema(table_name, where_conditions, select_fields)
+        tables = []
+        async for chunk in self.stream_data_by_time_windows(
+            table_name, start_time, end_time, where_conditions, select_fields, **options
+        ):
+            if chunk.data:
+                tables.append(_records_to_arrow(chunk.data, schema))
+        
+        if not tables:
+            return schema.empty_table()
+        return pa.concat_tables(tables)
+    
+    def write_table(self,
+                    table: pa.Table,
+                    output_path: str,
+                    output_format: str = "json",
+                    write_buffer_bytes: Optional[int] = None):
+        """
+        将Arrow表写入文件（同步执行，可放到线程中运行）
+        
+        json为记录数组，jsonl为每行一条记录；与 export_to_file 不同，不包含数据块信息。
+        """
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        buffer_size = write_buffer_bytes or DEFAULT_CONFIG["write_buffer_bytes"]
+        
+        if output_format == "jsonl":
+            with open(output_path, 'wb', buffering=buffer_size) as f:
+                for batch in table.to_batches():
+                    for row in batch.to_pylist():
+                        f.write(_json_dumps(row) + b'\n')
+        
+        elif output_format == "json":
+            with open(output_path, 'wb', buffering=buffer_size) as f:
+                f.write(b'[')
+                first = True
+                for batch in table.to_batches():
+                    for row in batch.to_pylist():
+                        f.write(b'\n' if first else b',\n')
+                        f.write(_json_dumps(row))
+                        first = False
+                f.write(b'\n]\n')
+        
+        elif output_format == "csv":
+            with pa.output_stream(str(output_path), compression=None, buffer_size=buffer_size) as sink:
+                pacsv.write_csv(_csv_compatible(table), sink, write_options=_CSV_WRITE_OPTIONS)
+        
+        elif output_format == "parquet":
+            pq.write_table(table, output_path, compression="zstd")
+        
+        else:
+            raise ValueError(f"不支持的输出格式: {output_format}")
+        
+        logger.info(f"数据已写入: {output_path}")
+    
+    async def _copy_export(self,
+                           table_name: str,
+                           start_dt: datetime,
+                           end_dt: datetime,
+                           output_path: Path,
+                           output_format: str,
+                           where_conditions: Optional[WhereConditions] = None,
+                           select_fields: Optional[List[str]] = None):
+        """
+        通过 COPY ... TO STDOUT 一次性导出整个时间范围
+        
+        数据由服务端直接编码为CSV写入文件，不经过逐行解码。
+        Parquet先COPY到同目录下的临时CSV，再由pyarrow按查询结果的列类型读入并转换
+        （整表会载入内存）；数组、二进制和时间间隔列保存为PostgreSQL的文本形式。
+        """
+        if output_format not in ("csv", "parquet"):
+            raise ValueError(f"批量导出不支持的输出格式: {output_format}")
+        
+        query = await self._build_select_query(table_name, where_conditions, select_fields)
+        args = [start_dt, end_dt, *_where_args(where_conditions)]
+        
+        if output_format == "parquet":
+            # 列类型取自数据库，不由CSV内容推断（否则文本ID如"0012"会被读成整数）
+            column_types = _csv_column_types(
+                await self._result_schema(table_name, where_conditions, select_fields)
+            )
+        
+        async with self._acquire() as conn:
+            if output_format == "csv":
+                await conn.copy_from_query(
+                    query, *args, output=str(output_path), format="csv", header=True
+                )
+                return
+            
+            fd, tmp_path = tempfile.mkstemp(suffix=".csv", dir=output_path.parent)
+            os.close(fd)
+            try:
+                await conn.copy_from_query(
+                    query, *args, output=tmp_path, format="csv", header=True
+                )
+                # COPY的CSV中布尔值为t/f，空值为未加引号的空字段（空字符串会加引号）；
+                # 只把空字段当作空值，"NA"、"null"等文本保持原样
+                table = pacsv.read_csv(tmp_path, convert_options=pacsv.ConvertOptions(
+                    column_types=column_types, true_values=["t"], false_values=["f"],
+                    null_values=[""], strings_can_be_null=True, quoted_strings_can_be_null=False
+                ))
+            finally:
+                os.unlink(tmp_path)
+        
+        pq.write_table(table, output_path, compression="zstd")
+    
     async def export_to_file(self, 
                            table_name: str,
                            start_time: Union[str, datetime],
@@ -320,54 +1532,104 @@ class TimeSeriesDataFetcher:
                            output_path: str,
                            output_format: str = "json",
                            use_time_windows: bool = True,
-                           where_conditions: Optional[str] = None,
-                           select_fields: Optional[List[str]] = None):
-        """导出数据到文件"""
+                           where_conditions: Optional[WhereConditions] = None,
+                           select_fields: Optional[List[str]] = None,
+                           bulk: Optional[bool] = None,
+                           write_buffer_bytes: Optional[int] = None,
+                           chunk_size: Optional[int] = None,
+                           time_interval_minutes: Optional[float] = None):
+        """
+        导出数据到文件
+        
+        Args:
+            bulk: 是否使用COPY批量导出（仅支持csv/parquet）。默认在不使用时间窗口
+                  且输出csv/parquet时自动启用
+            write_buffer_bytes: 写缓冲区大小，缓冲区写满才落盘，减少系统调用次数
+            chunk_size, time_interval_minutes: 本次导出的数据块大小和时间窗口间隔，默认使用构造时的设置
+        """
         output_path = Path(output_path)
         output_path.parent.mkdir(parents=True, exist_ok=True)
+        buffer_size = write_buffer_bytes or DEFAULT_CONFIG["write_buffer_bytes"]
+        
+        start_time = self.parse_time(start_time)
+        end_time = self.parse_time(end_time)
+        
+        if bulk is None:
+            bulk = not use_time_windows and output_format in ("csv", "parquet")
+        if bulk:
+            await self._copy_export(
+                table_name, start_time, end_time, output_path, output_format,
+                where_conditions, select_fields
+            )
+            logger.info(f"数据已导出到: {output_path}")
+            return
+        
+        if output_format in ("csv", "parquet"):
+            # 各数据块按数据库的列类型构建，写入的schema不随某一块的数据变化
+            schema = await self._result_schema(table_name, where_conditions, select_fields,
+                                               paginated=not use_time_windows)
         
         if use_time_windows:
             data_stream = self.stream_data_by_time_windows(
-                table_name, start_time, end_time, where_conditions, select_fields
+                table_name, start_time, end_time, where_conditions, select_fields,
+                chunk_size=chunk_size, time_interval_minutes=time_interval_minutes
             )
         else:
             data_stream = self.stream_data_by_chunks(
-                table_name, start_time, end_time, where_conditions, select_fields
+                table_name, start_time, end_time, where_conditions, select_fields,
+                chunk_size=chunk_size
             )
         
         if output_format == "jsonl":
             # JSON Lines格式，每行一个JSON对象
-            with open(output_path, 'w', encoding='utf-8') as f:
+            with open(output_path, 'wb', buffering=buffer_size) as f:
                 async for chunk in data_stream:
-                    f.write(json.dumps(chunk, ensure_ascii=False, default=str) + '\n')
+                    f.write(_json_dumps(chunk) + b'\n')
         
         elif output_format == "json":
-            # 完整JSON数组格式
-            all_chunks = []
-            async for chunk in data_stream:
-                all_chunks.append(chunk)
-            
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(all_chunks, f, ensure_ascii=False, indent=2, default=str)
+            # 完整JSON数组格式，逐块写入，内存占用只与块大小有关
+            with open(output_path, 'wb', buffering=buffer_size) as f:
+                f.write(b'[\n')
+                first = True
+                async for chunk in data_stream:
+                    if not first:
+                        f.write(b',\n')
+                    f.write(_json_dumps(chunk, indent=True))
+                    first = False
+                f.write(b'\n]\n')
         
         elif output_format == "csv":
-            # CSV格式，合并所有数据
-            all_data = []
-            async for chunk in data_stream:
-                all_data.extend(chunk["data"])
-            
-            if all_data:
-                df = pd.DataFrame(all_data)
-                df.to_csv(output_path, index=False)
+            # CSV格式，同一个writer逐块写入，表头只写一次
+            writer = None
+            sink = None
+            try:
+                async for chunk in data_stream:
+                    if not chunk.data:
+                        continue
+                    table = _csv_compatible(_records_to_arrow(chunk.data, schema))
+                    if writer is None:
+                        sink = pa.output_stream(str(output_path), compression=None,
+                                                buffer_size=buffer_size)
+                        writer = pacsv.CSVWriter(sink, table.schema, write_options=_CSV_WRITE_OPTIONS)
+                    writer.write_table(table)
+            finally:
+                if writer is not None:
+                    writer.close()
+                if sink is not None:
+                    sink.close()
         
         elif output_format == "parquet":
-            # Parquet格式
-            all_data = []
-            async for chunk in data_stream:
-                all_data.extend(chunk["data"])
-            
-            if all_data:
-                df = pd.DataFrame(all_data)
-                df.to_parquet(output_path)
+            # Parquet格式，每块作为一个row group追加写入
+            writer = None
+            try:
+                async for chunk in data_stream:
+                    if not chunk.data:
+                        continue
+                    if writer is None:
+                        writer = pq.ParquetWriter(output_path, schema, compression="zstd")
+                    writer.write_table(_records_to_arrow(chunk.data, schema))
+            finally:
+                if writer is not None:
+                    writer.close()
         
         logger.info(f"数据已导出到: {output_path}") 
\ No newline at end of file
@@ -4,267 +4,340 @@
 """
 
 import asyncio
-import json
+import contextvars
+import io
+import logging
+import sys
+from contextlib import redirect_stdout
 from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import AsyncIterator, Dict
+
+import numpy as np
+import pyarrow.compute as pc
 
 from data_fetcher import TimeSeriesDataFetcher
 
-async def example_basic_usage():
+# 逐块的详细信息只在DEBUG级别输出，汇总信息仍直接打印
+logger = logging.getLogger(__name__)
+
+# 并发运行时每个示例的输出缓冲区
+_example_output = contextvars.ContextVar("example_output", default=None)
+
+class _BufferedStdout:
+    """把print输出写入当前任务的缓冲区，避免并发示例的输出交错"""
+    
+    def __init__(self, stream):
+        self.stream = stream
+    
+    def write(self, text: str) -> int:
+        buf = _example_output.get()
+        return (buf if buf is not None else self.stream).write(text)
+    
+    def flush(self):
+        self.stream.flush()
+
+async def _prefetch(stream: AsyncIterator[Dict], n: int) -> AsyncIterator[Dict]:
+    """
+    在后台提前拉取最多n个数据块，让下一批查询与当前块的处理重叠
+    
+    生产者中的异常会在消费端重新抛出；消费端提前退出时取消生产者并关闭数据流。
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=n)
+    done = object()
+    
+    async def produce():
+        try:
+            async for chunk in stream:
+                await queue.put(chunk)
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(done)
+    
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
+        await stream.aclose()
+
+def _process_chunk(batch) -> float:
+    """计算一个数据块的平均点赞数（同步函数，在工作线程中运行）"""
+    return pc.mean(batch.column("likes")).as_py() or 0.0
+
+async def _run_buffered(example, buf: io.StringIO, *args):
+    """在独立的输出缓冲区中运行一个示例"""
+    _example_output.set(buf)
+    await example(*args)
+
+async def example_basic_usage(fetcher: TimeSeriesDataFetcher, end_time: datetime):
     """基本使用示例"""
     print("=== 基本使用示例 ===")
     
-    # 创建数据获取器
-    fetcher = TimeSeriesDataFetcher(
-        chunk_size=100,           # 每次获取100条记录
-        time_interval_minutes=30, # 30分钟时间窗口
-        max_connections=2
-    )
+    # 定义时间范围（获取最近1天的数据）
+    start_time = end_time - timedelta(days=1)
     
-    try:
-        # 初始化连接
-        await fetcher.init_connection()
-        
-        # 定义时间范围（获取最近1天的数据）
-        end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(days=1)
-        
-        print(f"获取时间范围: {start_time} ~ {end_time}")
-        
-        # 获取推文数据
-        chunk_count = 0
-        total_records = 0
-        
-        async for chunk in fetcher.stream_data_by_time_windows(
-            table_name="tweets",
-            start_time=start_time,
-            end_time=end_time
-        ):
-            chunk_count += 1
-            chunk_size = chunk["chunk_size"]
-            total_records += chunk_size
-            
-            print(f"处理块 {chunk_count}: {chunk_size} 条记录")
-            print(f"  时间窗口: {chunk['window_start']} ~ {chunk['window_end']}")
-            print(f"  累计记录: {total_records}")
-            
-            # 处理数据（这里只是打印第一条记录的tweet_id）
-            if chunk["data"]:
-                first_record = chunk["data"][0]
-                print(f"  示例记录ID: {first_record.get('tweet_id', 'N/A')}")
-            
-            print()
+    print(f"获取时间范围: {start_time} ~ {end_time}")
+    
+    # 获取推文数据
+    chunk_count = 0
+    total_records = 0
+    
+    async for chunk in _prefetch(fetcher.stream_data_by_time_windows(
+        table_name="tweets",
+        start_time=start_time,
+        end_time=end_time,
+        return_format="arrow"  # 数据块以列式的RecordBatch返回
+    ), fetcher.max_connections):
+        chunk_count += 1
+        chunk_size = chunk.chunk_size
+        total_records += chunk_size
         
-        print(f"获取完成: 总共 {chunk_count} 个块, {total_records} 条记录")
+        logger.debug("处理块 %d: %d 条记录, 时间窗口: %s ~ %s, 累计记录: %d",
+                     chunk_count, chunk_size, chunk.window_start, chunk.window_end,
+                     total_records)
         
-    finally:
-        await fetcher.close_connection()
+        # 处理数据（这里只是输出第一条记录的tweet_id，直接从列中取值）
+        if chunk_size and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("  示例记录ID: %s", chunk.batch.column("tweet_id")[0].as_py())
+    
+    print(f"获取完成: 总共 {chunk_count} 个块, {total_records} 条记录")
 
-async def example_with_filters():
+async def example_with_filters(fetcher: TimeSeriesDataFetcher, end_time: datetime):
     """带筛选条件的示例"""
     print("\n=== 带筛选条件的示例 ===")
     
-    fetcher = TimeSeriesDataFetcher(chunk_size=50)
+    # 获取最近12小时的数据
+    start_time = end_time - timedelta(hours=12)
     
-    try:
-        await fetcher.init_connection()
-        
-        # 获取最近12小时的数据
-        end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(hours=12)
-        
-        # 只获取特定用户的推文，且likes > 10
-        where_conditions = "user_id = '1234567890' AND likes > 10"
+    # 只获取特定用户的推文，且likes > 10；条件值作为查询参数传入
+    predicate = "user_id = $1 AND likes > $2"
+    params = ("1234567890", 10)
+    
+    # 只选择特定字段
+    select_fields = ["tweet_id", "user_id", "text", "created_at_ts", "likes", "retweets"]
+    
+    print(f"筛选条件: {predicate} {params}")
+    print(f"选择字段: {', '.join(select_fields)}")
+    
+    # 同一个过滤器的SQL文本固定，每个连接只需准备一次语句，之后可用不同参数反复执行
+    tweet_filter = await fetcher.prepared_filter("tweets", select_fields, predicate)
+    
+    chunk_count = 0
+    total_records = 0
+    
+    async for chunk in _prefetch(
+        tweet_filter.stream(params, start_time, end_time, chunk_size=50), fetcher.max_connections
+    ):
+        chunk_count += 1
+        total_records += chunk.chunk_size
         
-        # 只选择特定字段
-        select_fields = ["tweet_id", "user_id", "text", "created_at_ts", "likes", "retweets"]
+        if not logger.isEnabledFor(logging.DEBUG):
+            continue
         
-        print(f"筛选条件: {where_conditions}")
-        print(f"选择字段: {', '.join(select_fields)}")
+        data = chunk.data
+        n = len(data)
+        logger.debug("获取到 %d 条记录", n)
         
-        async for chunk in fetcher.stream_data_by_time_windows(
-            table_name="tweets",
-            start_time=start_time,
-            end_time=end_time,
-            where_conditions=where_conditions,
-            select_fields=select_fields
-        ):
-            print(f"获取到 {chunk['chunk_size']} 条记录")
-            
-            # 打印前3条记录
-            for i, record in enumerate(chunk["data"][:3]):
-                print(f"  记录 {i+1}: {record}")
-            
-            if len(chunk["data"]) > 3:
-                print(f"  ... 还有 {len(chunk['data']) - 3} 条记录")
+        # 输出前3条记录（islice不复制列表）
+        for i, record in enumerate(islice(data, 3)):
+            logger.debug("  记录 %d: %s", i + 1, record)
         
-    finally:
-        await fetcher.close_connection()
+        if n > 3:
+            logger.debug("  ... 还有 %d 条记录", n - 3)
+    
+    print(f"筛选完成: 总共 {chunk_count} 个块, {total_records} 条记录")
 
-async def example_export_to_file():
+async def example_export_to_file(fetcher: TimeSeriesDataFetcher, end_time: datetime):
     """导出到文件的示例"""
     print("\n=== 导出到文件的示例 ===")
     
-    fetcher = TimeSeriesDataFetcher(chunk_size=200)
+    # 获取最近6小时的用户数据
+    start_time = end_time - timedelta(hours=6)
     
-    try:
-        await fetcher.init_connection()
-        
-        # 获取最近6小时的用户数据
-        end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(hours=6)
-        
-        # 导出为JSON文件
-        await fetcher.export_to_file(
-            table_name="users",
-            start_time=start_time,
-            end_time=end_time,
-            output_path="output/users_recent.json",
-            output_format="json",
-            use_time_windows=True
-        )
-        print("JSON导出完成: output/users_recent.json")
-        
-        # 导出为CSV文件
-        await fetcher.export_to_file(
-            table_name="users",
-            start_time=start_time,
-            end_time=end_time,
-            output_path="output/users_recent.csv",
-            output_format="csv",
-            use_time_windows=False,  # 不使用时间窗口，直接按记录分块
-            select_fields=["user_id", "user_name", "user_screen_name", "user_followers_count", "updated_at"]
-        )
-        print("CSV导出完成: output/users_recent.csv")
-        
-        # 导出为JSONL文件（流式JSON）
-        await fetcher.export_to_file(
-            table_name="users",
-            start_time=start_time,
-            end_time=end_time,
-            output_path="output/users_recent.jsonl",
-            output_format="jsonl",
-            use_time_windows=True
-        )
-        print("JSONL导出完成: output/users_recent.jsonl")
-        
-    finally:
-        await fetcher.close_connection()
+    # 只查询一次数据库，再从同一个Arrow表写出三种格式
+    table = await fetcher.fetch_table(
+        table_name="users",
+        start_time=start_time,
+        end_time=end_time,
+        chunk_size=200
+    )
+    print(f"获取到 {table.num_rows} 条记录")
+    
+    if table.num_rows == 0:
+        print("无数据，跳过导出")
+        return
+    
+    csv_fields = ["user_id", "user_name", "user_screen_name", "user_followers_count", "updated_at"]
+    outputs = [
+        (table, "output/users_recent.json", "json"),
+        (table.select(csv_fields), "output/users_recent.csv", "csv"),
+        (table, "output/users_recent.jsonl", "jsonl"),  # 流式JSON，每行一条记录
+    ]
+    
+    # 写文件是同步的编码和IO，放到线程中并发执行，不阻塞事件循环
+    await asyncio.gather(*(
+        asyncio.to_thread(fetcher.write_table, data, path, output_format)
+        for data, path, output_format in outputs
+    ))
+    
+    for _, path, output_format in outputs:
+        print(f"{output_format.upper()}导出完成: {path}")
 
-async def example_multiple_tables():
+async def example_multiple_tables(fetcher: TimeSeriesDataFetcher, end_time: datetime):
     """多表数据获取示例"""
     print("\n=== 多表数据获取示例 ===")
     
-    fetcher = TimeSeriesDataFetcher(chunk_size=100)
+    # 获取最近3小时的数据
+    start_time = end_time - timedelta(hours=3)
     
-    try:
-        await fetcher.init_connection()
+    tables_to_process = ["tweets", "replies", "users"]
+    
+    # 一次查询得到各表的记录数，无数据的表不再发起流式查询
+    counts = await fetcher.estimate_counts(tables_to_process, start_time, end_time)
+    
+    for table_name, count in counts.items():
+        print(f"\n处理表: {table_name}")
         
-        # 获取最近3小时的数据
-        end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(hours=3)
+        print(f"  总记录数: {count}")
         
-        tables_to_process = ["tweets", "replies", "users"]
+        if count == 0:
+            print("  无数据，跳过")
+            continue
         
-        for table_name in tables_to_process:
-            print(f"\n处理表: {table_name}")
-            
-            # 获取记录总数
-            total_count = await fetcher.get_table_count(
-                table_name=table_name,
-                start_time=start_time,
-                end_time=end_time
-            )
-            print(f"  总记录数: {total_count}")
-            
-            if total_count == 0:
-                print("  无数据，跳过")
-                continue
+        # 流式获取数据
+        processed_records = 0
+        async for chunk in fetcher.stream_data_by_chunks(
+            table_name=table_name,
+            start_time=start_time,
+            end_time=end_time,
+            total_count=count  # 已经统计过，不再重复查询总数
+        ):
+            total_count = chunk.total_count
+            processed_records += chunk.chunk_size
+            progress = chunk.progress
+            logger.debug("  处理进度: %.1f%% (%d/%d)", progress * 100, processed_records, total_count)
             
-            # 流式获取数据
-            processed_records = 0
-            async for chunk in fetcher.stream_data_by_chunks(
-                table_name=table_name,
-                start_time=start_time,
-                end_time=end_time
-            ):
-                processed_records += chunk["chunk_size"]
-                progress = chunk["progress"]
-                print(f"  处理进度: {progress:.1%} ({processed_records}/{total_count})")
-                
-                # 这里可以对数据进行处理
-                # 例如：数据清洗、转换、分析等
-                
-            print(f"  表 {table_name} 处理完成")
+            # 这里可以对数据进行处理
+            # 例如：数据清洗、转换、分析等
         
-    finally:
-        await fetcher.close_connection()
+        if processed_records == 0:
+            print("  无数据，跳过")
+            continue
+        
+        print(f"  表 {table_name} 处理完成")
 
-async def example_real_time_style():
+async def example_real_time_style(fetcher: TimeSeriesDataFetcher, end_time: datetime):
     """模拟实时数据获取的示例"""
     print("\n=== 模拟实时数据获取的示例 ===")
     
-    fetcher = TimeSeriesDataFetcher(
-        chunk_size=50,
-        time_interval_minutes=5  # 5分钟时间窗口，模拟实时处理
-    )
+    # 模拟处理最近1小时的数据，但按5分钟窗口分块
+    start_time = end_time - timedelta(hours=1)
+    interval_minutes = 5
     
-    try:
-        await fetcher.init_connection()
+    print(f"模拟实时处理: {start_time} ~ {end_time}")
+    print(f"每{interval_minutes}分钟一个时间窗口")
+    
+    # 一次查询统计各窗口的记录数，只查询非空的窗口
+    histogram = await fetcher.window_histogram("tweets", start_time, end_time, interval_minutes)
+    print(f"非空时间窗口: {len(histogram)} 个")
+    
+    window_count = 0
+    last_window = None
+    total_records = 0
+    
+    async for chunk in _prefetch(fetcher.stream_data_by_time_windows(
+        table_name="tweets",
+        start_time=start_time,
+        end_time=end_time,
+        only_windows=[i for i, count in histogram.items() if count > 0],
+        return_format="arrow",
+        chunk_size=50,
+        time_interval_minutes=interval_minutes  # 5分钟时间窗口，模拟实时处理
+    ), fetcher.max_connections):
+        window_start = chunk.window_start
+        window_end = chunk.window_end
+        chunk_size = chunk.chunk_size
         
-        # 模拟处理最近1小时的数据，但按5分钟窗口分块
-        end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(hours=1)
+        # 空窗口和被跳过的窗口不产出数据块，按实际出现的窗口计数
+        if chunk.window_index != last_window:
+            last_window = chunk.window_index
+            window_count += 1
+        total_records += chunk_size
         
-        print(f"模拟实时处理: {start_time} ~ {end_time}")
-        print("每5分钟一个时间窗口")
+        logger.debug("时间窗口 %d: %s ~ %s, 处理 %d 条记录",
+                     chunk.window_index, window_start, window_end, chunk_size)
         
-        async for chunk in fetcher.stream_data_by_time_windows(
-            table_name="tweets",
-            start_time=start_time,
-            end_time=end_time
-        ):
-            window_start = chunk["window_start"]
-            window_end = chunk["window_end"]
-            chunk_size = chunk["chunk_size"]
-            
-            print(f"时间窗口 {chunk['window_index']}: {window_start} ~ {window_end}")
-            print(f"  处理 {chunk_size} 条记录")
+        if chunk.data:
+            # 简单的数据统计（直接在likes列上求均值，不逐条转换记录）；
+            # 放到线程中计算，大数据块不会阻塞事件循环和后台预取
+            avg_likes = await asyncio.to_thread(_process_chunk, chunk.batch)
             
-            if chunk["data"]:
-                # 模拟数据处理延迟
-                await asyncio.sleep(0.1)
-                
-                # 简单的数据统计
-                likes_sum = sum(record.get("likes", 0) for record in chunk["data"])
-                avg_likes = likes_sum / chunk_size if chunk_size > 0 else 0
-                
-                print(f"  平均点赞数: {avg_likes:.1f}")
-            
-            print()
-        
-        print("实时数据处理完成")
-        
-    finally:
-        await fetcher.close_connection()
+            logger.debug("  平均点赞数: %.1f", avg_likes)
+    
+    print(f"实时数据处理完成: {window_count} 个时间窗口, {total_records} 条记录")
 
 async def main():
     """运行所有示例"""
     print("时间序列数据获取工具 - 使用示例")
     print("=" * 50)
     
+    # 所有示例共用一个获取器和连接池，只建立一次连接
+    fetcher = TimeSeriesDataFetcher(
+        chunk_size=100,           # 每次获取100条记录
+        time_interval_minutes=30, # 30分钟时间窗口
+        max_connections=8,
+        # 计数类字段用32位整数即可，列式数据块中的这些列占用减半
+        column_dtypes={"likes": np.int32, "retweets": np.int32, "user_followers_count": np.int32}
+    )
+    
+    # 所有示例使用同一个结束时间，时间范围彼此一致
+    end_time = datetime.now(timezone.utc)
+    
     try:
-        await example_basic_usage()
-        # await example_with_filters()
-        # await example_export_to_file()
-        # await example_multiple_tables()
-        # await example_real_time_style()
+        await fetcher.init_connection()
+        
+        examples = (
+            example_basic_usage,
+            # example_with_filters,
+            # example_export_to_file,
+            # example_multiple_tables,
+            # example_real_time_style,
+        )
+        
+        # 各示例互不依赖，并发运行，分别从连接池获取连接；输出先缓冲，结束后按顺序打印
+        buffers = [io.StringIO() for _ in examples]
+        with redirect_stdout(_BufferedStdout(sys.stdout)):
+            results = await asyncio.gather(
+                *(_run_buffered(example, buf, fetcher, end_time) for example, buf in zip(examples, buffers)),
+                return_exceptions=True
+            )
+        
+        for buf in buffers:
+            print(buf.getvalue(), end="")
+        
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
         
         print("\n所有示例运行完成！")
         
-    except Exception as e:
-        print(f"示例运行出错: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("示例运行出错")
+    
+    finally:
+        await fetcher.close_connection()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file